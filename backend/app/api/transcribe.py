@@ -1,44 +1,88 @@
+import asyncio
+import hashlib
+import io
 import logging
 import math
 import os
 import shutil
 import tempfile
 import time
-from threading import Lock
-
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Iterator
+from functools import cache, lru_cache
+from typing import BinaryIO
+
+import numpy as np
+import soundfile as sf
+import soxr
 from fastapi import APIRouter, File, HTTPException, Query, UploadFile
-from faster_whisper import WhisperModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from faster_whisper import BatchedInferencePipeline, WhisperModel
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/api", tags=["transcribe"])
 
 MODEL_NAME = os.getenv("WHISPER_MODEL", "base")
-model = WhisperModel(MODEL_NAME)
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "auto")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_NUM_WORKERS = int(os.getenv("WHISPER_NUM_WORKERS", "2"))
+WHISPER_CPU_THREADS = int(
+    os.getenv(
+        "WHISPER_CPU_THREADS",
+        str(max(1, (os.cpu_count() or 4) // WHISPER_NUM_WORKERS)),
+    )
+)
+_SUPPORTED_COMPUTE_TYPES = (
+    "default",
+    "auto",
+    "int8",
+    "int8_float16",
+    "int8_float32",
+    "int8_bfloat16",
+    "float16",
+    "bfloat16",
+    "float32",
+)
+if WHISPER_COMPUTE_TYPE not in _SUPPORTED_COMPUTE_TYPES:
+    raise ValueError(
+        f"Unsupported WHISPER_COMPUTE_TYPE={WHISPER_COMPUTE_TYPE!r}; "
+        f"expected one of {', '.join(_SUPPORTED_COMPUTE_TYPES)}"
+    )
+model = WhisperModel(
+    MODEL_NAME,
+    device=WHISPER_DEVICE,
+    compute_type=WHISPER_COMPUTE_TYPE,
+    cpu_threads=WHISPER_CPU_THREADS,
+    num_workers=WHISPER_NUM_WORKERS,
+)
+batched_model = BatchedInferencePipeline(model=model)
 logger = logging.getLogger("uvicorn.error")
 
+TRANSCRIBE_BATCH_SIZE = int(os.getenv("TRANSCRIBE_BATCH_SIZE", "8"))
+TRANSCRIBE_CACHE_SIZE = int(os.getenv("TRANSCRIBE_CACHE_SIZE", "128"))
+UPLOAD_COPY_CHUNK_SIZE = 1024 * 1024
+UPLOAD_MAX_IN_MEMORY_BYTES = int(os.getenv("TRANSCRIBE_MAX_IN_MEMORY_BYTES", str(64 * 1024 * 1024)))
+WHISPER_SAMPLE_RATE = 16000
 RTF_ESTIMATE_DEFAULT = float(os.getenv("TRANSCRIBE_RTF_ESTIMATE", "1.0"))
 RTF_ESTIMATE_ALPHA = float(os.getenv("TRANSCRIBE_RTF_ALPHA", "0.2"))
-_rtf_lock = Lock()
+_RTF_ONE_MINUS_ALPHA = 1.0 - RTF_ESTIMATE_ALPHA
 _rtf_avg: float | None = None
-_model_log_lock = Lock()
-_model_logged = False
+_BYTE_UNITS = ("B", "KB", "MB", "GB", "TB", "PB")
+_transcript_cache: OrderedDict[tuple, "TranscriptResponse"] = OrderedDict()
 
 
 def _format_bytes(size: int) -> str:
-    units = ["B", "KB", "MB", "GB", "TB"]
-    readable = float(size)
-    for unit in units:
-        if readable < 1024.0:
-            if unit == "B":
-                return f"{int(readable)}{unit}"
-            return f"{readable:.1f}{unit}"
-        readable /= 1024.0
-    return f"{readable:.1f}PB"
+    idx = 0 if size <= 0 else min((size.bit_length() - 1) // 10, len(_BYTE_UNITS) - 1)
+    if idx == 0:
+        return f"{int(size)}B"
+    return f"{size / (1 << (10 * idx)):.1f}{_BYTE_UNITS[idx]}"
 
 
 def _format_seconds(seconds: float) -> str:
     if seconds <= 0:
         return "0s"
+    if seconds < 59.5:
+        return f"{int(round(seconds))}s"
     total = int(round(seconds))
     minutes, secs = divmod(total, 60)
     hours, minutes = divmod(minutes, 60)
@@ -49,6 +93,7 @@ def _format_seconds(seconds: float) -> str:
     return f"{secs}s"
 
 
+@lru_cache(maxsize=1)
 def _get_hf_cache_dir() -> str:
     cache_dir = os.getenv("HUGGINGFACE_HUB_CACHE") or os.getenv("HF_HUB_CACHE")
     if cache_dir:
@@ -62,33 +107,47 @@ def _get_hf_cache_dir() -> str:
     return os.path.expanduser("~/.cache/huggingface/hub")
 
 
-def _log_model_details_once() -> None:
-    global _model_logged
-    with _model_log_lock:
-        if _model_logged:
-            return
-        _model_logged = True
+@lru_cache(maxsize=1)
+def _resolved_model_info() -> tuple[str | None, str | None]:
+    if os.path.exists(MODEL_NAME):
+        return os.path.abspath(MODEL_NAME), None
+    return None, _get_hf_cache_dir()
+
 
-    model_path = os.path.abspath(MODEL_NAME) if os.path.exists(MODEL_NAME) else None
+@cache
+def _log_model_details_once() -> None:
+    model_path, hf_cache_dir = _resolved_model_info()
     if model_path:
         logger.info("Whisper model: %s (local path)", model_path)
     else:
         logger.info("Whisper model: %s", MODEL_NAME)
-        logger.info("Hugging Face cache dir: %s", _get_hf_cache_dir())
+        logger.info("Hugging Face cache dir: %s", hf_cache_dir)
+    logger.info(
+        "Whisper runtime: device=%s compute_type=%s cpu_threads=%s num_workers=%s",
+        WHISPER_DEVICE,
+        WHISPER_COMPUTE_TYPE,
+        WHISPER_CPU_THREADS,
+        WHISPER_NUM_WORKERS,
+    )
+
+
+def warm_model() -> None:
+    _log_model_details_once()
+    start = time.perf_counter()
+    silence = np.zeros(WHISPER_SAMPLE_RATE, dtype=np.float32)
+    segments, _ = model.transcribe(silence, beam_size=1, vad_filter=False)
+    list(segments)
+    logger.info("Whisper warmup complete: elapsed=%s", _format_seconds(time.perf_counter() - start))
 
 
 def _get_rtf_estimate() -> float:
-    with _rtf_lock:
-        return _rtf_avg if _rtf_avg is not None else RTF_ESTIMATE_DEFAULT
+    return _rtf_avg if _rtf_avg is not None else RTF_ESTIMATE_DEFAULT
 
 
 def _update_rtf_estimate(rtf: float) -> None:
     global _rtf_avg
-    with _rtf_lock:
-        if _rtf_avg is None:
-            _rtf_avg = rtf
-        else:
-            _rtf_avg = (RTF_ESTIMATE_ALPHA * rtf) + ((1 - RTF_ESTIMATE_ALPHA) * _rtf_avg)
+    prev = _rtf_avg
+    _rtf_avg = rtf if prev is None else (RTF_ESTIMATE_ALPHA * rtf) + (_RTF_ONE_MINUS_ALPHA * prev)
 
 
 class TranscriptWord(BaseModel):
@@ -112,32 +171,143 @@ class TranscriptResponse(BaseModel):
     segments: list[TranscriptSegment]
 
 
-@router.post("/transcribe/segment", response_model=TranscriptResponse)
-async def transcribe_segment(
-    file: UploadFile = File(...),
-    language: str | None = Query(None, description="Optional language code, e.g. en"),
-    beam_size: int = Query(5, ge=1, le=10),
-    vad_filter: bool = Query(True),
-):
+def _decode_pcm(source: BinaryIO) -> np.ndarray | None:
+    try:
+        audio, sample_rate = sf.read(source, dtype="float32", always_2d=True)
+    except sf.SoundFileError:
+        source.seek(0)
+        return None
+    audio = audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+    if sample_rate != WHISPER_SAMPLE_RATE:
+        audio = soxr.resample(audio, sample_rate, WHISPER_SAMPLE_RATE, quality="QQ")
+    return audio
+
+
+def _read_upload(
+    source: BinaryIO, size: int | None, suffix: str
+) -> tuple[np.ndarray | BinaryIO | str, str | None, int]:
+    if size is None:
+        size = source.seek(0, os.SEEK_END)
+        source.seek(0)
+    if size > UPLOAD_MAX_IN_MEMORY_BYTES:
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+            shutil.copyfileobj(source, tmp, UPLOAD_COPY_CHUNK_SIZE)
+            tmp.flush()
+            tmp_path = tmp.name
+        return tmp_path, tmp_path, os.path.getsize(tmp_path)
+    audio = _decode_pcm(source)
+    if audio is not None:
+        return audio, None, size
+    if isinstance(source, tempfile.SpooledTemporaryFile) and not source._rolled:
+        source.seek(0)
+        return source, None, size
+    buf = io.BytesIO()
+    shutil.copyfileobj(source, buf, UPLOAD_COPY_CHUNK_SIZE)
+    buf.seek(0)
+    return buf, None, size
+
+
+def _hash_upload(source: BinaryIO) -> str:
+    digest = hashlib.sha1(usedforsecurity=False)
+    while chunk := source.read(UPLOAD_COPY_CHUNK_SIZE):
+        digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+def _remove_file(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _build_segment(segment, word_timestamps: bool) -> TranscriptSegment:
+    text = segment.text.strip()
+    avg_logprob = segment.avg_logprob
+    raw_words = segment.words if word_timestamps else None
+    if isinstance(avg_logprob, (int, float)):
+        confidence = float(np.clip(math.exp(avg_logprob), 0.0, 1.0))
+    elif raw_words:
+        probs = np.fromiter(
+            (word.probability for word in raw_words),
+            dtype=np.float32,
+            count=len(raw_words),
+        )
+        confidence = float(probs.mean())
+    else:
+        confidence = None
+    word_entries = None
+    if raw_words is not None:
+        word_entries = [
+            TranscriptWord.model_construct(
+                start=word.start,
+                end=word.end,
+                word=word.word,
+                probability=word.probability,
+            )
+            for word in raw_words
+        ]
+    return TranscriptSegment.model_construct(
+        start=segment.start,
+        end=segment.end,
+        text=text,
+        confidence=confidence,
+        words=word_entries,
+    )
+
+
+def _collect_segments(
+    segments: Iterable, word_timestamps: bool
+) -> tuple[list[TranscriptSegment], list[str]]:
+    out_segments = []
+    texts = []
+    for segment in segments:
+        out_segment = _build_segment(segment, word_timestamps)
+        if out_segment.text:
+            texts.append(out_segment.text)
+        out_segments.append(out_segment)
+    return out_segments, texts
+
+
+def _log_completion(start: float, audio_duration: float | None) -> None:
+    elapsed = time.perf_counter() - start
+    if audio_duration:
+        rtf = elapsed / audio_duration if audio_duration > 0 else 0.0
+        if rtf:
+            _update_rtf_estimate(rtf)
+        logger.info(
+            "Transcribe complete: elapsed=%s rtf=%.2f",
+            _format_seconds(elapsed),
+            rtf,
+        )
+    else:
+        logger.info("Transcribe complete: elapsed=%s", _format_seconds(elapsed))
+
+
+async def _start_transcription(
+    file: UploadFile,
+    language: str | None,
+    beam_size: int,
+    vad_filter: bool,
+    word_timestamps: bool,
+    transcribe_fn: Callable | None = None,
+    **decode_options,
+) -> tuple[Iterable, object]:
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file provided")
 
     await file.seek(0)
     suffix = os.path.splitext(file.filename)[1] or ".audio"
     tmp_path = None
-    start = time.perf_counter()
 
     try:
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-            shutil.copyfileobj(file.file, tmp)
-            tmp.flush()
-            tmp_path = tmp.name
+        audio, tmp_path, file_size = await asyncio.to_thread(
+            _read_upload, file.file, file.size, suffix
+        )
 
         _log_model_details_once()
 
-        file_size = os.path.getsize(tmp_path)
         logger.info(
-            "Transcribe request: filename=%s content_type=%s size=%s model=%s language=%s beam_size=%s vad_filter=%s",
+            "Transcribe request: filename=%s content_type=%s size=%s model=%s language=%s beam_size=%s vad_filter=%s word_timestamps=%s",
             file.filename,
             file.content_type,
             _format_bytes(file_size),
@@ -145,92 +315,203 @@ async def transcribe_segment(
             language,
             beam_size,
             vad_filter,
+            word_timestamps,
         )
 
-        segments, info = model.transcribe(
-            tmp_path,
+        segments, info = await asyncio.to_thread(
+            transcribe_fn or model.transcribe,
+            audio,
             language=language,
             beam_size=beam_size,
             vad_filter=vad_filter,
-            word_timestamps=True,
+            word_timestamps=word_timestamps,
+            **decode_options,
         )
-        audio_duration = getattr(info, "duration", None)
-        if audio_duration:
-            rtf_estimate = _get_rtf_estimate()
-            estimated_seconds = audio_duration * rtf_estimate
-            logger.info(
-                "Transcribe estimate: audio_duration=%.2fs rtf_estimate=%.2f estimated_time=%s",
-                audio_duration,
-                rtf_estimate,
-                _format_seconds(estimated_seconds),
-            )
-        else:
-            logger.info("Transcribe estimate: audio_duration unavailable")
+    except Exception:
+        logger.exception("Transcribe failed")
+        raise
+    finally:
+        if tmp_path:
+            await asyncio.to_thread(_remove_file, tmp_path)
 
-        out_segments = []
-        texts = []
-        for segment in segments:
-            text = segment.text.strip()
-            if text:
-                texts.append(text)
-            confidence = None
-            avg_logprob = getattr(segment, "avg_logprob", None)
-            if isinstance(avg_logprob, (int, float)):
-                confidence = math.exp(avg_logprob)
-                confidence = max(0.0, min(1.0, confidence))
-            else:
-                raw_words = getattr(segment, "words", None)
-                if raw_words:
-                    probs = [
-                        getattr(word, "probability", None)
-                        for word in raw_words
-                        if isinstance(getattr(word, "probability", None), (int, float))
-                    ]
-                    if probs:
-                        confidence = sum(probs) / len(probs)
-            word_entries = None
-            raw_words = getattr(segment, "words", None)
-            if raw_words is not None:
-                word_entries = [
-                    TranscriptWord(
-                        start=word.start,
-                        end=word.end,
-                        word=word.word,
-                        probability=word.probability,
-                    )
-                    for word in raw_words
-                ]
-            out_segments.append(
-                TranscriptSegment(
-                    start=segment.start,
-                    end=segment.end,
-                    text=text,
-                    confidence=confidence,
-                    words=word_entries,
-                )
-            )
+    audio_duration = getattr(info, "duration", None)
+    if audio_duration:
+        rtf_estimate = _get_rtf_estimate()
+        estimated_seconds = audio_duration * rtf_estimate
+        logger.info(
+            "Transcribe estimate: audio_duration=%.2fs rtf_estimate=%.2f estimated_time=%s",
+            audio_duration,
+            rtf_estimate,
+            _format_seconds(estimated_seconds),
+        )
+    else:
+        logger.info("Transcribe estimate: audio_duration unavailable")
+    return segments, info
+
+
+async def _transcribe_upload(
+    file: UploadFile,
+    language: str | None,
+    beam_size: int,
+    vad_filter: bool,
+    word_timestamps: bool,
+    **decode_options,
+) -> TranscriptResponse:
+    start = time.perf_counter()
+    cache_key = None
+    if TRANSCRIBE_CACHE_SIZE > 0 and file.filename:
+        await file.seek(0)
+        digest = await asyncio.to_thread(_hash_upload, file.file)
+        cache_key = (
+            digest,
+            language,
+            beam_size,
+            vad_filter,
+            word_timestamps,
+            tuple(sorted(decode_options.items())),
+        )
+        cached = _transcript_cache.get(cache_key)
+        if cached is not None:
+            _transcript_cache.move_to_end(cache_key)
+            logger.info("Transcribe cache hit: filename=%s sha1=%s", file.filename, digest)
+            return cached
 
-        elapsed = time.perf_counter() - start
-        if audio_duration:
-            rtf = elapsed / audio_duration if audio_duration > 0 else 0.0
-            if rtf:
-                _update_rtf_estimate(rtf)
-            logger.info(
-                "Transcribe complete: elapsed=%s rtf=%.2f",
-                _format_seconds(elapsed),
-                rtf,
-            )
-        else:
-            logger.info("Transcribe complete: elapsed=%s", _format_seconds(elapsed))
+    segments, info = await _start_transcription(
+        file, language, beam_size, vad_filter, word_timestamps, **decode_options
+    )
+
+    try:
+        out_segments, texts = await asyncio.to_thread(
+            _collect_segments, segments, word_timestamps
+        )
+        _log_completion(start, getattr(info, "duration", None))
 
-        return TranscriptResponse(
-            text=" ".join(texts).strip(),
+        response = TranscriptResponse.model_construct(
+            text=" ".join(texts),
             language=getattr(info, "language", None),
             segments=out_segments,
         )
+        if cache_key is not None:
+            _transcript_cache[cache_key] = response
+            if len(_transcript_cache) > TRANSCRIBE_CACHE_SIZE:
+                _transcript_cache.popitem(last=False)
+        return response
     except Exception:
         logger.exception("Transcribe failed")
         raise
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
+
+
+def _stream_segments(
+    segments: Iterable,
+    info,
+    start: float,
+    word_timestamps: bool,
+) -> Iterator[bytes]:
+    try:
+        for segment in segments:
+            yield _build_segment(segment, word_timestamps).model_dump_json().encode() + b"\n"
+        _log_completion(start, getattr(info, "duration", None))
+    except Exception:
+        logger.exception("Transcribe failed")
+        raise
+
+
+@router.post("/transcribe/segment", response_model=TranscriptResponse)
+async def transcribe_segment(
+    file: UploadFile = File(...),
+    language: str | None = Query(None, description="Optional language code, e.g. en"),
+    beam_size: int = Query(5, ge=1, le=10),
+    vad_filter: bool = Query(True),
+    word_timestamps: bool = Query(False, description="Include per-word timings"),
+):
+    response = await _transcribe_upload(file, language, beam_size, vad_filter, word_timestamps)
+    return ORJSONResponse(response.model_dump())
+
+
+@router.post(
+    "/transcribe/segment/fast",
+    response_model=TranscriptResponse,
+    description=(
+        "Greedy decoding for short or live segments: beam_size=1, a single "
+        "temperature-0 pass and no conditioning on previous text. Noticeably "
+        "faster than /transcribe/segment, at the cost of slightly lower accuracy "
+        "on difficult audio."
+    ),
+)
+async def transcribe_segment_fast(
+    file: UploadFile = File(...),
+    language: str | None = Query(None, description="Optional language code, e.g. en"),
+    vad_filter: bool = Query(True),
+    word_timestamps: bool = Query(False, description="Include per-word timings"),
+):
+    response = await _transcribe_upload(
+        file,
+        language,
+        beam_size=1,
+        vad_filter=vad_filter,
+        word_timestamps=word_timestamps,
+        best_of=1,
+        temperature=0.0,
+        condition_on_previous_text=False,
+    )
+    return ORJSONResponse(response.model_dump())
+
+
+@router.post(
+    "/transcribe/segment/stream",
+    response_class=StreamingResponse,
+    description=(
+        "Streams segments as newline-delimited JSON while decoding runs, one "
+        "TranscriptSegment per line. The detected language is returned in the "
+        "X-Transcript-Language header."
+    ),
+)
+async def transcribe_segment_stream(
+    file: UploadFile = File(...),
+    language: str | None = Query(None, description="Optional language code, e.g. en"),
+    beam_size: int = Query(5, ge=1, le=10),
+    vad_filter: bool = Query(True),
+    word_timestamps: bool = Query(False, description="Include per-word timings"),
+):
+    start = time.perf_counter()
+    segments, info = await _start_transcription(
+        file, language, beam_size, vad_filter, word_timestamps
+    )
+    detected_language = getattr(info, "language", None)
+    headers = {"X-Transcript-Language": detected_language} if detected_language else None
+    return StreamingResponse(
+        _stream_segments(segments, info, start, word_timestamps),
+        media_type="application/x-ndjson",
+        headers=headers,
+    )
+
+
+@router.post(
+    "/transcribe/batch",
+    response_model=list[TranscriptResponse],
+    description=(
+        "Transcribes several files with faster-whisper's BatchedInferencePipeline, "
+        "which runs up to batch_size VAD-detected speech chunks of each file "
+        "through the encoder together. Results are returned in upload order."
+    ),
+)
+async def transcribe_batch(
+    files: list[UploadFile] = File(...),
+    language: str | None = Query(None, description="Optional language code, e.g. en"),
+    beam_size: int = Query(5, ge=1, le=10),
+    word_timestamps: bool = Query(False, description="Include per-word timings"),
+    batch_size: int = Query(TRANSCRIBE_BATCH_SIZE, ge=1, le=64),
+):
+    responses = []
+    for file in files:
+        response = await _transcribe_upload(
+            file,
+            language,
+            beam_size,
+            True,
+            word_timestamps,
+            transcribe_fn=batched_model.transcribe,
+            batch_size=batch_size,
+        )
+        responses.append(response.model_dump())
+    return ORJSONResponse(responses)
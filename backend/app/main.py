@@ -1,8 +1,20 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 from app.api.transcribe import router as transcribe_router
+from app.api.transcribe import warm_model
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(warm_model)
+    yield
+
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 app.include_router(transcribe_router)
 
 
@@ -0,0 +1,97 @@
+import faster_whisper
+import numpy as np
+import pytest
+from faster_whisper.audio import decode_audio
+from faster_whisper.transcribe import Segment, TranscriptionInfo, Word
+
+SAMPLE_RATE = 16000
+
+
+def _to_array(audio) -> np.ndarray:
+    if isinstance(audio, np.ndarray):
+        return audio
+    return decode_audio(audio, sampling_rate=SAMPLE_RATE)
+
+
+class StubWhisperModel:
+    def __init__(self, *args, **kwargs):
+        self.init_kwargs = kwargs
+        self.calls = []
+
+    def transcribe(self, audio, **kwargs):
+        self.calls.append((audio, kwargs))
+        samples = _to_array(audio)
+        duration = len(samples) / SAMPLE_RATE
+        word_timestamps = kwargs.get("word_timestamps", False)
+
+        def segments():
+            for i in range(2):
+                words = (
+                    [Word(start=float(i), end=i + 0.5, word=" hi", probability=0.9)]
+                    if word_timestamps
+                    else None
+                )
+                yield Segment(
+                    id=i,
+                    seek=0,
+                    start=float(i),
+                    end=i + 1.0,
+                    text=f" segment {i} ",
+                    tokens=[1],
+                    avg_logprob=-0.1,
+                    compression_ratio=1.0,
+                    no_speech_prob=0.0,
+                    words=words,
+                    temperature=0.0,
+                )
+
+        info = TranscriptionInfo(
+            language="en",
+            language_probability=1.0,
+            duration=duration,
+            duration_after_vad=duration,
+            all_language_probs=None,
+            transcription_options=None,
+            vad_options=None,
+        )
+        return segments(), info
+
+
+class StubBatchedInferencePipeline:
+    def __init__(self, model):
+        self.model = model
+        self.calls = []
+
+    def transcribe(self, audio, batch_size=8, clip_timestamps=None, **kwargs):
+        self.calls.append((audio, dict(kwargs, batch_size=batch_size)))
+        samples = _to_array(audio)
+        if not kwargs.get("vad_filter", True) and clip_timestamps is None:
+            if len(samples) / SAMPLE_RATE >= 30:
+                raise RuntimeError(
+                    "No clip timestamps found. "
+                    "Set 'vad_filter' to True or provide 'clip_timestamps'."
+                )
+        return self.model.transcribe(samples, **kwargs)
+
+
+faster_whisper.WhisperModel = StubWhisperModel
+faster_whisper.BatchedInferencePipeline = StubBatchedInferencePipeline
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.api import transcribe  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _reset_stubs():
+    transcribe.model.calls.clear()
+    transcribe.batched_model.calls.clear()
+    transcribe._transcript_cache.clear()
+    yield
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
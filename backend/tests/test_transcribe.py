@@ -0,0 +1,143 @@
+import asyncio
+import io
+import json
+import os
+
+import numpy as np
+import soundfile as sf
+from fastapi import UploadFile
+
+from app.api import transcribe
+
+
+def _wav(seconds: float = 2.0, sample_rate: int = 16000, channels: int = 1) -> bytes:
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    tone = (0.1 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+    buf = io.BytesIO()
+    sf.write(buf, np.repeat(tone[:, None], channels, axis=1), sample_rate, format="WAV")
+    return buf.getvalue()
+
+
+def _upload(data: bytes, name: str = "clip.wav"):
+    return {"file": (name, data, "audio/wav")}
+
+
+def test_segment_response_shape(client):
+    response = client.post("/api/transcribe/segment", files=_upload(_wav()))
+
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) == {"text", "language", "segments"}
+    assert body["text"] == "segment 0 segment 1"
+    assert body["language"] == "en"
+    for segment in body["segments"]:
+        assert set(segment) == {"start", "end", "text", "confidence", "words"}
+        assert segment["words"] is None
+    transcribe.TranscriptResponse.model_validate(body)
+
+
+def test_segment_response_shape_with_words(client):
+    response = client.post(
+        "/api/transcribe/segment?word_timestamps=true", files=_upload(_wav())
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    for segment in body["segments"]:
+        assert set(segment) == {"start", "end", "text", "confidence", "words"}
+        assert [set(word) for word in segment["words"]] == [
+            {"start", "end", "word", "probability"}
+        ]
+    transcribe.TranscriptResponse.model_validate(body)
+
+
+def test_format_bytes_unit_boundaries():
+    assert transcribe._format_bytes(0) == "0B"
+    assert transcribe._format_bytes(1023) == "1023B"
+    assert transcribe._format_bytes(1024) == "1.0KB"
+    assert transcribe._format_bytes(2**20 - 1) == "1024.0KB"
+    assert transcribe._format_bytes(2**50 - 1) == "1024.0TB"
+    assert transcribe._format_bytes(2**50) == "1.0PB"
+    assert transcribe._format_bytes(2**60) == "1024.0PB"
+
+
+def test_stream_emits_one_segment_per_line(client):
+    response = client.post("/api/transcribe/segment/stream", files=_upload(_wav()))
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["x-transcript-language"] == "en"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["text"] for line in lines] == ["segment 0", "segment 1"]
+
+
+def test_temp_file_removed_before_segments_are_consumed(monkeypatch):
+    monkeypatch.setattr(transcribe, "UPLOAD_MAX_IN_MEMORY_BYTES", 0)
+    data = _wav()
+    upload = UploadFile(io.BytesIO(data), size=len(data), filename="clip.wav")
+
+    segments, _ = asyncio.run(
+        transcribe._start_transcription(upload, None, 5, True, False)
+    )
+
+    tmp_path = transcribe.model.calls[-1][0]
+    assert isinstance(tmp_path, str)
+    assert not os.path.exists(tmp_path)
+    assert len(list(segments)) == 2
+
+
+def test_small_upload_is_downmixed_and_resampled(client):
+    data = _wav(seconds=2.0, sample_rate=48000, channels=2)
+
+    response = client.post("/api/transcribe/segment", files=_upload(data))
+
+    assert response.status_code == 200
+    audio, _ = transcribe.model.calls[-1]
+    assert isinstance(audio, np.ndarray)
+    assert audio.dtype == np.float32
+    assert audio.shape == (32000,)
+
+
+def test_large_upload_skips_in_memory_decode(client, monkeypatch):
+    data = _wav(seconds=2.0, sample_rate=48000, channels=2)
+    monkeypatch.setattr(transcribe, "UPLOAD_MAX_IN_MEMORY_BYTES", len(data) - 1)
+
+    response = client.post("/api/transcribe/segment", files=_upload(data))
+
+    assert response.status_code == 200
+    audio, _ = transcribe.model.calls[-1]
+    assert isinstance(audio, str)
+    assert not os.path.exists(audio)
+
+
+def test_batch_always_uses_vad_on_long_audio(client):
+    data = _wav(seconds=31.0)
+
+    response = client.post(
+        "/api/transcribe/batch?vad_filter=false&batch_size=4",
+        files=[
+            ("files", ("a.wav", data, "audio/wav")),
+            ("files", ("b.wav", _wav(), "audio/wav")),
+        ],
+    )
+
+    assert response.status_code == 200
+    assert [body["text"] for body in response.json()] == ["segment 0 segment 1"] * 2
+    calls = transcribe.batched_model.calls
+    assert [kwargs["vad_filter"] for _, kwargs in calls] == [True, True]
+    assert [kwargs["batch_size"] for _, kwargs in calls] == [4, 4]
+
+
+def test_repeated_upload_is_served_from_cache(client):
+    data = _wav()
+    calls_before = len(transcribe.model.calls)
+
+    first = client.post("/api/transcribe/segment", files=_upload(data, "a.wav"))
+    second = client.post("/api/transcribe/segment", files=_upload(data, "b.wav"))
+    with_words = client.post(
+        "/api/transcribe/segment?word_timestamps=true", files=_upload(data, "a.wav")
+    )
+
+    assert first.json() == second.json()
+    assert with_words.json()["segments"][0]["words"] is not None
+    assert len(transcribe.model.calls) - calls_before == 2